@@ -1,83 +1,234 @@
+import orjson
+import requests
+import sqlite3
 import subprocess
-import json
-import pandas as pd
+import threading
+import time
 
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain, repeat
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.retry import Retry
+
+# Number of calls sent to nexad in a single JSON-RPC batch request, kept small enough
+# that one response stays a few megabytes at most
+BLOCK_HASH_BATCH_SIZE = 1000
+BLOCK_BATCH_SIZE = 50
+TRANSACTION_BATCH_SIZE = 100
+
+# The REST interface has no batching, so REST block requests are spread over many small
+# worker tasks to run in parallel across the threads instead of one after another
+REST_BLOCK_BATCH_SIZE = 5
+
+# Minimum number of seconds between two progress messages
+PROGRESS_INTERVAL = 1.0
+
+# (connect, read) timeouts in seconds for every request to nexad, so a stalled daemon or
+# a dead keep-alive socket fails that call instead of blocking its worker and pooled connection
+RPC_TIMEOUT = (5, 120)
 
 class NexaCLI:
-    def __init__(self, cli_path, rpc_user, rpc_password):
-        self.cli_path = f'"{cli_path}"'
+    def __init__(self, rpc_user, rpc_password, rpc_host="127.0.0.1", rpc_port=7227, pool_size=10, cli_path=None):
+        self.url = f"http://{rpc_host}:{rpc_port}/"
         self.rpc_user = rpc_user
         self.rpc_password = rpc_password
-
-    def run_command(self, command):
-        full_command = f"{self.cli_path} -rpcuser={self.rpc_user} -rpcpassword={self.rpc_password} {command}"
+        self.pool_size = pool_size
+
+        # Optional nexa-cli executable, used once the JSON-RPC HTTP interface turned out to be unreachable
+        self.cli_path = cli_path
+        self.use_cli = False
+
+        # Keep one keep-alive connection per worker so consecutive calls reuse their TCP socket.
+        # All worker threads share this pool; pool_block makes extra threads wait for a free
+        # connection instead of opening one that would be thrown away afterwards.
+        # Only connection failures and 502/503/504 are retried; a read timeout is not, so a stalled
+        # call gives up after one RPC_TIMEOUT instead of re-posting its batch to a struggling daemon.
+        retry = Retry(total=3, read=0, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+        self.session = requests.Session()
+        self.session.auth = (rpc_user, rpc_password)
+        self.session.headers["Content-Type"] = "application/json"
+        self.session.mount("http://", adapter)
+
+    def run_command(self, method, *params):
+        if self.use_cli:
+            return self.run_cli_command(method, *params)
+
+        payload = {"jsonrpc": "1.0", "id": 0, "method": method, "params": list(params)}
         try:
-            result = subprocess.run(full_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, shell=True)
-            if result.stdout:
-                return result.stdout.strip()
-            elif result.stderr:
-                print(f"Error: {result.stderr.strip()}")
-                return ""
-        except Exception as e:
+            response = self.session.post(self.url, data=orjson.dumps(payload), timeout=RPC_TIMEOUT)
+            reply = orjson.loads(response.content)
+        except (requests.RequestException, ValueError) as e:
             print(f"Exception occurred: {e}")
-            return ""
-
-def get_latest_block_height(cli):
-    # Get the latest block height
-    command = "getblockcount"
-    output = cli.run_command(command)
-    if output.isdigit():
-        return int(output.strip())
-    else:
-        print(f"Failed to retrieve block count: {output}")
-        return None
-
-def get_block_data(cli, block_height):
-    command = f"getblockhash {block_height}"
-    block_hash = cli.run_command(command).strip()
-
-    if not block_hash:
-        print(f"Failed to retrieve block hash for height {block_height}")
-        return {}
-
-    command = f"getblock {block_hash} 1"
-    block_data_output = cli.run_command(command)
-
-    try:
-        block_data = json.loads(block_data_output)
-    except json.JSONDecodeError as e:
-        print(f"JSONDecodeError for block {block_height}: {e}")
-        print(f"Command output: {block_data_output}")
-        return {}
-
-    return {block_height: block_data}
-
-def get_transaction_data(cli, txid):
-    command = f"getrawtransaction {txid} 1"
-    output = cli.run_command(command)
-
-    if "error code: -5" in output:
-        print(f"getrawtransaction failed for {txid}, transaction might not be indexed or is not in the mempool.")
-        return None
-
-    if not output:
-        print(f"Error: No output for transaction {txid}")
-        return None
+            if self.fall_back_to_cli(e):
+                return self.run_cli_command(method, *params)
+            return None
+
+        error = reply.get("error")
+        if error:
+            print(f"Error: {method} failed with code {error.get('code')}: {error.get('message')}")
+            return None
+        return reply.get("result")
+
+    def batch(self, calls):
+        # Send several (method, params) calls in one HTTP request; results keep the order of calls
+        if self.use_cli:
+            return [self.run_cli_command(method, *params) for method, params in calls]
+
+        payload = [{"jsonrpc": "1.0", "id": i, "method": method, "params": list(params)} for i, (method, params) in enumerate(calls)]
+        results = [None] * len(calls)
+        try:
+            response = self.session.post(self.url, data=orjson.dumps(payload), timeout=RPC_TIMEOUT)
+            replies = orjson.loads(response.content)
+        except (requests.RequestException, ValueError) as e:
+            print(f"Exception occurred: {e}")
+            if self.fall_back_to_cli(e):
+                return [self.run_cli_command(method, *params) for method, params in calls]
+            return results
+
+        if not isinstance(replies, list):
+            print(f"Error: batch request failed: {replies.get('error')}")
+            return results
+
+        # Replies are matched on their id since the daemon does not have to keep the request order
+        for reply in replies:
+            method = calls[reply["id"]][0]
+            error = reply.get("error")
+            if error:
+                print(f"Error: {method} failed with code {error.get('code')}: {error.get('message')}")
+            else:
+                results[reply["id"]] = reply.get("result")
+        return results
+
+    def fall_back_to_cli(self, e):
+        # Switch to nexa-cli for the rest of the run only when nexad cannot be connected to at all,
+        # that is a refused connection or a connect timeout. Overload, dropped connections, read
+        # timeouts and unreadable replies only fail the call that ran into them.
+        reason = getattr(e.args[0], "reason", None) if e.args else None
+        if self.cli_path and isinstance(reason, (NewConnectionError, ConnectTimeoutError)):
+            print(f"Falling back to {self.cli_path}")
+            self.use_cli = True
+        return self.use_cli
+
+    def run_cli_command(self, method, *params):
+        # Run nexa-cli directly from an argument list, without a shell parsing a command string
+        args = [self.cli_path, f"-rpcuser={self.rpc_user}", f"-rpcpassword={self.rpc_password}", method]
+        args.extend(str(param).lower() if isinstance(param, bool) else str(param) for param in params)
+        try:
+            result = subprocess.run(args, capture_output=True)
+        except OSError as e:
+            print(f"Exception occurred: {e}")
+            return None
 
-    try:
-        transaction_data = json.loads(output)
-    except json.JSONDecodeError as e:
-        print(f"JSONDecodeError for transaction {txid}: {e}")
-        print(f"Command output: {output}")
-        return None
+        if result.returncode != 0:
+            print(f"Error: {result.stderr.decode(errors='replace').strip()}")
+            return None
 
-    return transaction_data
+        # JSON results are printed as JSON, plain strings such as block hashes are printed as is
+        output = result.stdout.strip()
+        try:
+            return orjson.loads(output)
+        except orjson.JSONDecodeError:
+            return output.decode()
 
-def get_latest_n_blocks(cli, n, num_processes=None):
-    latest_block_height = get_latest_block_height(cli)
+    def get_block_rest(self, block_hash):
+        # The REST interface (nexad -rest=1) serves the same block JSON as getblock with verbosity 1
+        try:
+            response = self.session.get(f"{self.url}rest/block/notxdetails/{block_hash}.json", timeout=RPC_TIMEOUT)
+            response.raise_for_status()
+            return orjson.loads(response.content)
+        except (requests.RequestException, ValueError) as e:
+            print(f"Exception occurred: {e}")
+            return None
+
+class TransactionCache:
+    def __init__(self, db_path):
+        # The connection is shared by the worker threads, every access goes through the lock
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS transactions (txid TEXT PRIMARY KEY, data BLOB NOT NULL)")
+
+    def get_many(self, txids):
+        placeholders = ",".join("?" * len(txids))
+        with self.lock:
+            rows = self.connection.execute(f"SELECT txid, data FROM transactions WHERE txid IN ({placeholders})", txids).fetchall()
+        return {txid: orjson.loads(data) for txid, data in rows}
+
+    def put_many(self, transactions):
+        # transactions is a list of (txid, transaction_data) pairs
+        rows = [(txid, orjson.dumps(transaction_data)) for txid, transaction_data in transactions]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO transactions (txid, data) VALUES (?, ?)", rows)
+
+def chunk_list(items, chunk_size):
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+def get_block_hashes(cli, block_heights):
+    hashes = cli.batch([("getblockhash", [block_height]) for block_height in block_heights])
+
+    block_hashes = {}
+    for block_height, block_hash in zip(block_heights, hashes):
+        if not block_hash:
+            print(f"Failed to retrieve block hash for height {block_height}")
+            continue
+        block_hashes[block_height] = block_hash
+
+    return block_hashes
+
+def get_blocks_data(cli, block_hashes, use_rest=False):
+    # block_hashes is a list of (block_height, block_hash) pairs
+    if use_rest:
+        blocks = [cli.get_block_rest(block_hash) for _, block_hash in block_hashes]
+    else:
+        blocks = cli.batch([("getblock", [block_hash, 1]) for _, block_hash in block_hashes])
+
+    blocks_data = {}
+    for (block_height, block_hash), block_data in zip(block_hashes, blocks):
+        if not block_data:
+            print(f"Failed to retrieve block {block_height} ({block_hash})")
+            continue
+        blocks_data[block_height] = block_data
+
+    return blocks_data
+
+def get_transactions_data(cli, txid_blocks, cache=None):
+    # txid_blocks is a list of (txid, block_hash) pairs naming the block that listed each txid
+    txids = [txid for txid, _ in txid_blocks]
+
+    # Only ask the daemon for transactions that were not retrieved on a previous run. A cached
+    # transaction whose block was reorganized away has a stale blockhash and time, so refetch it.
+    cached = cache.get_many(txids) if cache is not None else {}
+    cached = {
+        txid: cached[txid] for txid, block_hash in txid_blocks
+        if txid in cached and cached[txid].get('blockhash') == block_hash
+    }
+    missing_txids = [txid for txid in txids if txid not in cached]
+    transactions = cli.batch([("getrawtransaction", [txid, 1]) for txid in missing_txids]) if missing_txids else []
+
+    # The RPC error is reported by batch; code -5 means the transaction is not indexed
+    fetched = {}
+    for txid, transaction_data in zip(missing_txids, transactions):
+        if not transaction_data:
+            print(f"getrawtransaction failed for {txid}, transaction might not be indexed or is not in the mempool.")
+            continue
+        fetched[txid] = transaction_data
+
+    if cache is not None and fetched:
+        cache.put_many(fetched.items())
+
+    # Failed transactions stay None so the result lines up with txids
+    return [cached[txid] if txid in cached else fetched.get(txid) for txid in txids]
+
+def get_latest_block_hashes(cli, n, executor):
+    # Returns (block_height, block_hash) pairs for the latest n blocks in ascending height order,
+    # so blocks and their transactions come out in chain order without sorting them afterwards
+    latest_block_height = cli.run_command("getblockcount")
     if latest_block_height is None:
-        return {}
+        print("Failed to retrieve block count")
+        return []
 
     if n > latest_block_height + 1:
         print(f"Warning: Requested {n} blocks, but only {latest_block_height + 1} are available. Adjusting to {latest_block_height + 1}.")
@@ -85,72 +236,126 @@ def get_latest_n_blocks(cli, n, num_processes=None):
 
     block_heights = [latest_block_height - i for i in range(n)]
 
-    print(f"Starting block data retrieval with {num_processes} parallel processes...")
-
-    blocks_dict = {}
-    with ProcessPoolExecutor(max_workers=num_processes) as executor:
-        futures = {executor.submit(get_block_data, cli, block_height): block_height for block_height in block_heights}
-        for i, future in enumerate(as_completed(futures)):
-            block_data = future.result()
-            blocks_dict.update(block_data)
-
-            # Print progress every 10 iterations
-            if (i + 1) % 10 == 0 or (i + 1) == len(block_heights):
-                percentage = ((i + 1) / len(block_heights)) * 100
-                print(f"Retrieved block {list(block_data.keys())[0]} ({i + 1}/{len(block_heights)}) - {percentage:.2f}% complete")
-
-    return blocks_dict
-
-
-
-def get_all_transactions(cli, blocks_dict, num_processes=None):
-    txids = [txid for block_data in blocks_dict.values() for txid in block_data.get('txid', [])]
-
-    print(f"Starting transaction data retrieval with {num_processes} parallel processes...")
-
-    transactions_data = []
-    with ProcessPoolExecutor(max_workers=num_processes) as executor:
-        futures = {executor.submit(get_transaction_data, cli, txid): txid for txid in txids}
-        for i, future in enumerate(as_completed(futures)):
-            tx_data = future.result()
-            if tx_data:
-                transactions_data.append(tx_data)
-            # Print real-time progress
-            percentage = ((i + 1) / len(txids)) * 100
-            if i % 10 == 0:  # Print every 10 iterations
-                print(f"Processed transaction ({i + 1}/{len(txids)}) - {percentage:.2f}% complete")
-
-    return transactions_data
-
-def save_block_data(df_blocks, save_json=False):
+    # The replies are parsed in the workers, the coordinator thread only merges the results.
+    # A reorg between these calls is reported afterwards by check_block_links.
+    block_hashes = {}
+    for hashes_chunk in executor.map(get_block_hashes, repeat(cli), chunk_list(block_heights, BLOCK_HASH_BATCH_SIZE)):
+        block_hashes.update(hashes_chunk)
+
+    # block_hashes was filled from the tip downwards
+    return list(block_hashes.items())[::-1]
+
+def check_block_links(blocks_dict):
+    # Heights are resolved independently, so check that the retrieved blocks still form one chain
+    for block_height, block_data in blocks_dict.items():
+        parent_block = blocks_dict.get(block_height - 1)
+        if parent_block is not None and block_data.get('previousblockhash') != parent_block['hash']:
+            print(f"Warning: Block {block_height} does not build on block {block_height - 1}, the chain was reorganized during retrieval.")
+
+def collect_txid_blocks(blocks):
+    # Returns (txid, block_hash) pairs for all transactions of the blocks, in block order
+    return list(chain.from_iterable(
+        zip(block_data['txid'], repeat(block_data['hash'])) for block_data in blocks if 'txid' in block_data
+    ))
+
+def refresh_confirmations(blocks_dict, transactions_data):
+    # Cached transactions carry the confirmation count from the run that stored them,
+    # so take it from their freshly retrieved block instead. transactions_data lines up with collect_txid_blocks.
+    start = 0
+    for block_data in blocks_dict.values():
+        block_txids = block_data.get('txid', ())
+        for tx_data in transactions_data[start:start + len(block_txids)]:
+            if tx_data is not None:
+                tx_data['confirmations'] = block_data['confirmations']
+        start += len(block_txids)
+
+def get_latest_n_blocks_and_transactions(cli, n, num_threads=None, use_rest=False, cache=None):
+    # The transactions of a block batch are requested as soon as that batch arrives,
+    # so block and transaction retrieval share the worker threads
+    num_threads = num_threads or cli.pool_size
+    print(f"Starting block and transaction data retrieval with {num_threads} parallel threads...")
+
+    block_batch_size = REST_BLOCK_BATCH_SIZE if use_rest else BLOCK_BATCH_SIZE
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        block_hashes = get_latest_block_hashes(cli, n, executor)
+        blocks_dict = dict.fromkeys(block_height for block_height, _ in block_hashes)
+
+        # Each block batch gets a preallocated transaction list, keyed by the first height of the batch
+        transactions_by_batch = {hashes_chunk[0][0]: None for hashes_chunk in chunk_list(block_hashes, block_batch_size)}
+        pending = {
+            executor.submit(get_blocks_data, cli, hashes_chunk, use_rest): (hashes_chunk[0][0], None)
+            for hashes_chunk in chunk_list(block_hashes, block_batch_size)
+        }
+        retrieved = 0
+        processed = 0
+        total_txids = 0
+        last_progress = time.monotonic()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch_key, start = pending.pop(future)
+                if start is None:
+                    # A block batch arrived, queue its transactions right away
+                    blocks_chunk = future.result()
+                    blocks_dict.update(blocks_chunk)
+                    txid_blocks = collect_txid_blocks(blocks_chunk.values())
+                    transactions_by_batch[batch_key] = [None] * len(txid_blocks)
+                    for txids_start in range(0, len(txid_blocks), TRANSACTION_BATCH_SIZE):
+                        txid_blocks_chunk = txid_blocks[txids_start:txids_start + TRANSACTION_BATCH_SIZE]
+                        pending[executor.submit(get_transactions_data, cli, txid_blocks_chunk, cache)] = (batch_key, txids_start)
+                    retrieved += len(blocks_chunk)
+                    total_txids += len(txid_blocks)
+                else:
+                    transactions_chunk = future.result()
+                    transactions_by_batch[batch_key][start:start + len(transactions_chunk)] = transactions_chunk
+                    processed += len(transactions_chunk)
+
+            # Print progress at most once per PROGRESS_INTERVAL and after the last batch
+            if time.monotonic() - last_progress >= PROGRESS_INTERVAL or not pending:
+                last_progress = time.monotonic()
+                print(f"Retrieved {retrieved}/{len(block_hashes)} blocks, processed {processed}/{total_txids} transactions of the retrieved blocks")
+
+    blocks_dict = {block_height: block_data for block_height, block_data in blocks_dict.items() if block_data is not None}
+    check_block_links(blocks_dict)
+
+    # Concatenating the batches in height order lines the transactions up with collect_txid_blocks(blocks_dict.values())
+    transactions_data = [tx_data for transactions_chunk in transactions_by_batch.values() for tx_data in transactions_chunk]
+    if cache is not None:
+        refresh_confirmations(blocks_dict, transactions_data)
+
+    return blocks_dict, [tx_data for tx_data in transactions_data if tx_data is not None]
+
+def save_block_data(blocks_dict, save_json=False):
     if save_json:
         json_file_name = "nexa_last_blocks.json"
-        df_blocks.to_json(json_file_name, orient='records')
+        with open(json_file_name, "wb") as f:
+            f.write(orjson.dumps(list(blocks_dict.values())))
         print(f"Block data saved to {json_file_name}")
 
 def save_transaction_data(transactions_data, save_json=False):
     if save_json:
         json_file_name = "nexa_transactions.json"
-        with open(json_file_name, "w") as f:
-            json.dump(transactions_data, f, indent=4)
+        with open(json_file_name, "wb") as f:
+            f.write(orjson.dumps(transactions_data, option=orjson.OPT_INDENT_2))
         print(f"Transaction data saved to {json_file_name}")
         
 if __name__ == "__main__":
-    cli_path = "C:/Program Files/Nexa/daemon/nexa-cli"
     rpc_user = "myusername"
     rpc_password = "mypassword"
-    cli = NexaCLI(cli_path, rpc_user, rpc_password)
-
+    cli_path = None  # e.g. "C:/Program Files/Nexa/daemon/nexa-cli", only used if nexad cannot be reached over HTTP
     n_blocks = 100
-    num_processes = 8  # You can adjust this number based on your system's capabilities
+    num_threads = 8  # Keep close to the rpcthreads/rpcworkqueue settings of nexad
+    use_rest = False  # Retrieve block bodies from the REST interface, requires nexad to run with -rest=1
 
-    blocks_dict = get_latest_n_blocks(cli, n_blocks, num_processes)
-    df_blocks = pd.DataFrame.from_dict(blocks_dict, orient='index')
+    cli = NexaCLI(rpc_user, rpc_password, pool_size=num_threads, cli_path=cli_path)
+    cache = TransactionCache("nexa_transactions_cache.sqlite")
 
-    print(df_blocks)
+    # Transactions are requested while the remaining blocks are still being retrieved
+    blocks_dict, transactions_data = get_latest_n_blocks_and_transactions(cli, n_blocks, num_threads, use_rest, cache)
 
-    save_block_data(df_blocks, save_json=True)
+    print(f"Retrieved {len(blocks_dict)} blocks with {len(transactions_data)} transactions")
 
-    transactions_dict = get_all_transactions(cli, blocks_dict, num_processes)
+    save_block_data(blocks_dict, save_json=True)
 
-    save_transaction_data(transactions_dict, save_json=True)
+    save_transaction_data(transactions_data, save_json=True)
@@ -1,7 +1,19 @@
-import json
+import os
+import orjson
+import numpy as np
 import pandas as pd
+import matplotlib
+
+# Render straight to image files without starting an interactive GUI backend
+matplotlib.use('Agg')
+
+import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 
+# Part of the Parquet file names written by load_processed_data. Bump it whenever process_block_data
+# or process_transaction_data change the columns or dtypes, so Parquet files of older runs are not reused.
+PROCESSED_DATA_VERSION = 1
+
 def read_json_file(file_path):
     """
     Reads a JSON file and returns its content.
@@ -10,14 +22,40 @@ def read_json_file(file_path):
     :return: Data contained in the JSON file.
     """
     try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
+        with open(file_path, 'rb') as f:
+            data = orjson.loads(f.read())
         print(f"Successfully read JSON file: {file_path}")
         return data
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
         return None
 
+def load_processed_data(json_file_path, process_function):
+    """
+    Loads processed data from the Parquet file next to the JSON file, or processes the JSON file
+    and stores the result as Parquet when the JSON file is not older than the Parquet file.
+    
+    :param json_file_path: Path to the JSON file written by fetch_data_blocks_transactions.py.
+    :param process_function: Function turning the JSON data into a DataFrame.
+    :return: DataFrame with processed data, or None if no data could be read.
+    """
+    parquet_file_path = f"{os.path.splitext(json_file_path)[0]}.v{PROCESSED_DATA_VERSION}.parquet"
+    if os.path.exists(parquet_file_path) and (
+        not os.path.exists(json_file_path) or os.path.getmtime(parquet_file_path) > os.path.getmtime(json_file_path)
+    ):
+        df_processed = pd.read_parquet(parquet_file_path)
+        print(f"Successfully read Parquet file: {parquet_file_path}")
+        return df_processed
+
+    data = read_json_file(json_file_path)
+    if not data:
+        return None
+
+    df_processed = process_function(data)
+    df_processed.to_parquet(parquet_file_path, compression='zstd')
+    print(f"Processed data saved to {parquet_file_path}")
+    return df_processed
+
 def process_block_data(block_data):
     """
     Processes block data into a DataFrame with a datetime index.
@@ -25,19 +63,20 @@ def process_block_data(block_data):
     :param block_data: List of block dictionaries.
     :return: DataFrame with processed block data.
     """
-    # Convert block data to DataFrame
-    df_blocks = pd.DataFrame(block_data)
-    
-    # Filter the desired columns from df_blocks and make a copy to avoid SettingWithCopyWarning
-    columns_to_keep_blocks = ['height', 'size', 'txcount', 'time', 'mediantime', 'difficulty']
-    df_filtered_blocks = df_blocks[columns_to_keep_blocks].copy()
+    # Build the DataFrame column by column with only the desired columns and their dtypes
+    columns_to_keep_blocks = {'height': 'int64', 'size': 'int64', 'txcount': 'int64', 'mediantime': 'int64', 'difficulty': 'float64'}
+    df_filtered_blocks = pd.DataFrame({
+        column: pd.Series([block.get(column) for block in block_data], dtype=dtype)
+        for column, dtype in columns_to_keep_blocks.items()
+    })
 
-    # Convert 'time' column to datetime and set as index for df_filtered_blocks
-    df_filtered_blocks.loc[:, 'time'] = pd.to_datetime(df_filtered_blocks['time'], unit='s')
-    df_filtered_blocks.set_index('time', inplace=True)
+    # Convert the raw 'time' seconds to datetime in one pass and use them as the index for df_filtered_blocks
+    block_times = np.fromiter((block['time'] for block in block_data), dtype='int64', count=len(block_data))
+    df_filtered_blocks.index = pd.DatetimeIndex(pd.to_datetime(block_times, unit='s'), name='time')
 
-    # Sort df_filtered_blocks in ascending order by the datetime index
-    df_filtered_blocks.sort_index(ascending=True, inplace=True)
+    # Blocks arrive in height order, so only sort when a block timestamp is earlier than its predecessor's
+    if not df_filtered_blocks.index.is_monotonic_increasing:
+        df_filtered_blocks.sort_index(ascending=True, inplace=True, kind='stable')
 
     return df_filtered_blocks
 
@@ -48,19 +87,25 @@ def process_transaction_data(transaction_data):
     :param transaction_data: List of transaction dictionaries.
     :return: DataFrame with processed transaction data.
     """
-    # Convert the list of transaction dictionaries into a DataFrame
-    df_transactions = pd.DataFrame(transaction_data)
-
-    # Create a new DataFrame with only the desired columns for transactions and make a copy to avoid SettingWithCopyWarning
-    columns_to_keep_transactions = ['size', 'locktime', 'spends', 'sends', 'fee', 'blockindex', 'blocktime', 'time', 'confirmations']
-    df_filtered_transactions = df_transactions[columns_to_keep_transactions].copy()
-
-    # Convert 'time' column to datetime and set as index for df_filtered_transactions
-    df_filtered_transactions.loc[:, 'time'] = pd.to_datetime(df_filtered_transactions['time'], unit='s')
-    df_filtered_transactions.set_index('time', inplace=True)
-
-    # Sort df_filtered_transactions in ascending order by the datetime index
-    df_filtered_transactions.sort_index(ascending=True, inplace=True)
+    # Build the DataFrame column by column with only the desired columns for transactions.
+    # 'sends' and 'fee' are made float64 here (missing values become NaN) so the aggregations stay numeric;
+    # the other columns without a dtype may be missing from some transactions and are inferred by pandas.
+    columns_to_keep_transactions = {
+        'size': 'int64', 'locktime': 'int64', 'spends': None, 'sends': 'float64', 'fee': 'float64',
+        'blockindex': None, 'blocktime': None, 'confirmations': None
+    }
+    df_filtered_transactions = pd.DataFrame({
+        column: pd.Series([transaction.get(column) for transaction in transaction_data], dtype=dtype)
+        for column, dtype in columns_to_keep_transactions.items()
+    })
+
+    # Convert the raw 'time' seconds to datetime in one pass and use them as the index for df_filtered_transactions
+    transaction_times = np.fromiter((transaction['time'] for transaction in transaction_data), dtype='int64', count=len(transaction_data))
+    df_filtered_transactions.index = pd.DatetimeIndex(pd.to_datetime(transaction_times, unit='s'), name='time')
+
+    # Transactions arrive in block order, so only sort when a block timestamp is earlier than its predecessor's
+    if not df_filtered_transactions.index.is_monotonic_increasing:
+        df_filtered_transactions.sort_index(ascending=True, inplace=True, kind='stable')
 
     return df_filtered_transactions
 
@@ -71,15 +116,18 @@ def calculate_hourly_volume_and_fees(df_filtered_transactions):
     :param df_filtered_transactions: DataFrame with transaction data and datetime index.
     :return: DataFrame with hourly aggregated volume and fees.
     """
-    # Ensure 'sends' and 'fee' columns are numeric
-    df_filtered_transactions['sends'] = pd.to_numeric(df_filtered_transactions['sends'], errors='coerce')
-    df_filtered_transactions['fee'] = pd.to_numeric(df_filtered_transactions['fee'], errors='coerce')
+    # Number every transaction's hour from the first hour, as int64 bucket offsets
+    hours = df_filtered_transactions.index.to_numpy().astype('datetime64[h]').astype('int64')
+    first_hour = hours.min() if hours.size else 0
+    hour_offsets = hours - first_hour
 
-    # Resample the data to hourly frequency and calculate the sum of 'sends' and 'fee' for each hour
-    df_hourly_aggregation = df_filtered_transactions.resample('H').agg({'sends': 'sum', 'fee': 'sum'})
+    # Sum 'sends' and 'fee' per hour bucket in one compiled pass each; hours without
+    # transactions get 0 and missing values count as 0, like the resample sum
+    hourly_volume = np.bincount(hour_offsets, weights=np.nan_to_num(df_filtered_transactions['sends'].to_numpy(dtype='float64')))
+    hourly_fees = np.bincount(hour_offsets, weights=np.nan_to_num(df_filtered_transactions['fee'].to_numpy(dtype='float64')))
 
-    # Rename columns for clarity
-    df_hourly_aggregation.rename(columns={'sends': 'hourly_volume', 'fee': 'hourly_fees'}, inplace=True)
+    hourly_index = pd.date_range(start=np.datetime64(int(first_hour), 'h'), periods=len(hourly_volume), freq='h', name='time')
+    df_hourly_aggregation = pd.DataFrame({'hourly_volume': hourly_volume, 'hourly_fees': hourly_fees}, index=hourly_index)
 
     return df_hourly_aggregation
 
@@ -90,8 +138,8 @@ def calculate_transactions_per_hour(df_filtered_transactions):
     :param df_filtered_transactions: DataFrame with transaction data and datetime index.
     :return: DataFrame with the count of transactions per hour.
     """
-    # Resample the data to hourly frequency and count the number of transactions for each hour
-    df_transactions_per_hour = df_filtered_transactions.resample('H').size()
+    # Count the number of transactions for each hour, filling the hours without transactions with 0
+    df_transactions_per_hour = df_filtered_transactions.index.floor('h').value_counts().sort_index().asfreq('h', fill_value=0)
 
     # Convert the series to a DataFrame for easier handling
     df_transactions_per_hour = df_transactions_per_hour.to_frame(name='transactions_per_hour')
@@ -105,28 +153,36 @@ def calculate_hourly_closing_difficulty(df_filtered_blocks):
     :param df_filtered_blocks: DataFrame with block data and datetime index.
     :return: DataFrame with the closing difficulty level for each hour.
     """
-    # Resample the data to hourly frequency and get the last difficulty value for each hour
-    df_hourly_closing_difficulty = df_filtered_blocks['difficulty'].resample('H').last()
+    # Group the difficulty by hour and get the last difficulty value for each hour
+    df_hourly_closing_difficulty = df_filtered_blocks['difficulty'].groupby(df_filtered_blocks.index.floor('h')).last().asfreq('h')
 
     # Convert the series to a DataFrame for easier handling
     df_hourly_closing_difficulty = df_hourly_closing_difficulty.to_frame(name='closing_difficulty')
 
     return df_hourly_closing_difficulty
 
-def plot_time_series(df_hourly_aggregation, df_transactions_per_hour, df_hourly_closing_difficulty):
+def plot_time_series(df_hourly_aggregation, df_transactions_per_hour, df_hourly_closing_difficulty, image_file_path="nexa_time_series.png"):
     """
-    Plots the time series data including hourly volume, fees, number of transactions, and difficulty.
+    Plots the time series data including hourly volume, fees, number of transactions, and difficulty
+    and saves the plots as a PNG image.
     
     :param df_hourly_aggregation: DataFrame with hourly aggregated volume and fees.
     :param df_transactions_per_hour: DataFrame with number of transactions per hour.
     :param df_hourly_closing_difficulty: DataFrame with closing difficulty level for each hour.
+    :param image_file_path: Path of the PNG image to write.
     """
+    # Convert each datetime index to matplotlib date numbers once instead of on every plot call
+    aggregation_dates = mdates.date2num(df_hourly_aggregation.index.to_numpy())
+    transactions_dates = mdates.date2num(df_transactions_per_hour.index.to_numpy())
+    difficulty_dates = mdates.date2num(df_hourly_closing_difficulty.index.to_numpy())
+
     plt.figure(figsize=(15, 10))
 
     # Plot hourly volume and fees
     plt.subplot(3, 1, 1)
-    plt.plot(df_hourly_aggregation.index, df_hourly_aggregation['hourly_volume'], label='Hourly Volume', color='blue')
-    plt.plot(df_hourly_aggregation.index, df_hourly_aggregation['hourly_fees'], label='Hourly Fees', color='green')
+    plt.plot(aggregation_dates, df_hourly_aggregation['hourly_volume'].to_numpy(), label='Hourly Volume', color='blue')
+    plt.plot(aggregation_dates, df_hourly_aggregation['hourly_fees'].to_numpy(), label='Hourly Fees', color='green')
+    plt.gca().xaxis_date()
     plt.title('Hourly Transaction Volume and Fees')
     plt.xlabel('Time')
     plt.ylabel('Value')
@@ -135,7 +191,8 @@ def plot_time_series(df_hourly_aggregation, df_transactions_per_hour, df_hourly_
 
     # Plot number of transactions per hour
     plt.subplot(3, 1, 2)
-    plt.bar(df_transactions_per_hour.index, df_transactions_per_hour['transactions_per_hour'], width=0.03, color='orange', label='Transactions per Hour')
+    plt.bar(transactions_dates, df_transactions_per_hour['transactions_per_hour'].to_numpy(), width=0.03, color='orange', label='Transactions per Hour')
+    plt.gca().xaxis_date()
     plt.title('Number of Transactions per Hour')
     plt.xlabel('Time')
     plt.ylabel('Number of Transactions')
@@ -144,26 +201,28 @@ def plot_time_series(df_hourly_aggregation, df_transactions_per_hour, df_hourly_
 
     # Plot hourly closing difficulty
     plt.subplot(3, 1, 3)
-    plt.plot(df_hourly_closing_difficulty.index, df_hourly_closing_difficulty['closing_difficulty'], label='Closing Difficulty', color='red')
+    plt.plot(difficulty_dates, df_hourly_closing_difficulty['closing_difficulty'].to_numpy(), label='Closing Difficulty', color='red')
+    plt.gca().xaxis_date()
     plt.title('Hourly Closing Difficulty')
     plt.xlabel('Time')
     plt.ylabel('Difficulty')
     plt.legend()
     plt.grid(True)
 
-    # Display the plots
+    # Save the plots in a single render pass
     plt.tight_layout()
-    plt.show()
+    plt.savefig(image_file_path, dpi=100)
+    plt.close()
+    print(f"Plots saved to {image_file_path}")
 
 if __name__ == "__main__":
     # File paths to the JSON files
     block_data_file_path = "nexa_last_blocks.json"  # Replace with your actual file path if different
     transaction_data_file_path = "nexa_transactions.json"  # Example filename; update with your actual timestamped file name
 
-    # Read and process block data
-    block_data = read_json_file(block_data_file_path)
-    if block_data:
-        df_filtered_blocks = process_block_data(block_data)
+    # Read and process block data, reusing the Parquet file of a previous run when it is up to date
+    df_filtered_blocks = load_processed_data(block_data_file_path, process_block_data)
+    if df_filtered_blocks is not None:
         print("\nFiltered Block DataFrame with Datetime Index (Sorted in Ascending Order):")
         print(df_filtered_blocks)
 
@@ -172,10 +231,9 @@ if __name__ == "__main__":
         print("\nHourly Closing Difficulty DataFrame:")
         print(df_hourly_closing_difficulty)
 
-    # Read and process transaction data
-    transaction_data = read_json_file(transaction_data_file_path)
-    if transaction_data:
-        df_filtered_transactions = process_transaction_data(transaction_data)
+    # Read and process transaction data, reusing the Parquet file of a previous run when it is up to date
+    df_filtered_transactions = load_processed_data(transaction_data_file_path, process_transaction_data)
+    if df_filtered_transactions is not None:
         print("\nFiltered Transaction DataFrame with Datetime Index (Sorted in Ascending Order):")
         print(df_filtered_transactions)
 